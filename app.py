@@ -1,11 +1,59 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, abort,
+                   send_from_directory, before_render_template, template_rendered, has_request_context)
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import gzip
+import hashlib
+import json
+import math
+import mimetypes
+import os
+import re
 import sqlite3
+import threading
+import time
+import click
+
+try:
+    import brotli
+except ImportError:  # optional: responses fall back to gzip
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 app.config['DATABASE'] = 'grading_system.db'
+# Per-school databases live in SHARD_DIR as <school>.db; users without a
+# school keep their students, subjects and grades in DATABASE
+app.config['SHARD_DIR'] = 'shards'
+app.config['SHARD_FANOUT_WORKERS'] = 8
+# Background job runner: concurrent jobs per process, idle poll interval and
+# how long a running job may go without a heartbeat before it is requeued
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_POLL_INTERVAL'] = 5
+app.config['JOB_STALE_AFTER'] = 60
+# Password hashing cost (werkzeug method string); existing hashes made with a
+# different method are upgraded transparently on the user's next login
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+# Login rate limiting: token buckets as (capacity, tokens refilled per second).
+# Set LOGIN_RATE_LIMIT_FILE to a path to share buckets between worker processes.
+app.config['LOGIN_RATE_LIMIT_IP'] = (30, 0.5)
+app.config['LOGIN_RATE_LIMIT_USERNAME'] = (5, 1 / 30)
+app.config['LOGIN_RATE_LIMIT_FILE'] = None
+# Number of reverse proxies in front of the app (e.g. 1 for nginx -> gunicorn).
+# Their X-Forwarded-For/-Proto headers are trusted so the per-IP login limit
+# sees the real client address instead of the proxy's.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
+# Response compression and static asset caching
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_LEVEL'] = 6
+app.config['STATIC_MAX_AGE'] = 365 * 24 * 3600
 
 # Database initialization
 def init_db():
@@ -28,7 +76,52 @@ def init_db():
         c.execute('ALTER TABLE users ADD COLUMN education_level TEXT DEFAULT "Secondary"')
     except sqlite3.OperationalError:
         pass  # Column already exists
+    # Add school (tenant key) column if it doesn't exist
+    try:
+        c.execute('ALTER TABLE users ADD COLUMN school TEXT DEFAULT NULL')
+    except sqlite3.OperationalError:
+        pass
     
+    # Students, subjects and grades of users without a school
+    create_tenant_tables(c)
+    
+    # Jobs table (background maintenance and bulk operations)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        message TEXT DEFAULT '',
+        result TEXT,
+        error TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        created_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        heartbeat_at TIMESTAMP,
+        FOREIGN KEY (created_by) REFERENCES users (id)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_scope ON jobs (status, scope)')
+    
+    conn.commit()
+    conn.close()
+
+    # Bring existing school databases up to date
+    for path in shard_paths():
+        init_shard_db(path)
+
+def init_shard_db(path):
+    conn = sqlite3.connect(path)
+    create_tenant_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+def create_tenant_tables(c):
+    """Create or migrate the per-school tables (students, subjects, grades)"""
     # Students table
     c.execute('''CREATE TABLE IF NOT EXISTS students (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -105,16 +198,94 @@ def init_db():
         FOREIGN KEY (subject_id) REFERENCES subjects (id),
         FOREIGN KEY (teacher_id) REFERENCES users (id)
     )''')
-    
-    conn.commit()
-    conn.close()
 
 # Database helper functions
-def get_db():
-    conn = sqlite3.connect(app.config['DATABASE'])
+SCHOOL_KEY_RE = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+_initialized_shards = set()
+
+def connect_db(path):
+    conn = sqlite3.connect(path)
     conn.row_factory = sqlite3.Row
     return conn
 
+def shard_path(school):
+    """Database file holding a school's data (the main database if none)"""
+    if not school:
+        return app.config['DATABASE']
+    return os.path.join(app.config['SHARD_DIR'], f'{school}.db')
+
+def shard_paths():
+    return sorted(glob.glob(os.path.join(app.config['SHARD_DIR'], '*.db')))
+
+def all_databases():
+    """The main database followed by every school database"""
+    return [app.config['DATABASE']] + shard_paths()
+
+def get_main_db():
+    """Connection to the main database (users, jobs and unsharded schools)"""
+    return connect_db(app.config['DATABASE'])
+
+@app.template_global()
+def available_schools():
+    return tuple(os.path.splitext(os.path.basename(path))[0] for path in shard_paths())
+
+@app.template_global()
+def current_school():
+    """School of the logged-in user, looked up once per request"""
+    if 'school' not in g:
+        school = None
+        if 'user_id' in session:
+            conn = get_main_db()
+            user = conn.execute('SELECT role, school FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+            conn.close()
+            if user:
+                school = user['school']
+                # Admins browse whichever school they picked in the nav
+                if user['role'] == 'admin' and 'admin_school' in session:
+                    school = session['admin_school'] or None
+        g.school = school
+    return g.school
+
+@app.template_global()
+def admin_viewing_all_schools():
+    """True for an admin who hasn't picked a school: totals cover every school"""
+    return session.get('role') == 'admin' and 'admin_school' not in session
+
+def get_db(school=None):
+    """Connection to a school's database, by default the current user's"""
+    if school is None and has_request_context():
+        school = current_school()
+    path = shard_path(school)
+    if path != app.config['DATABASE'] and path not in _initialized_shards:
+        os.makedirs(app.config['SHARD_DIR'], exist_ok=True)
+        init_shard_db(path)
+        _initialized_shards.add(path)
+    return connect_db(path)
+
+_fanout_pool = ThreadPoolExecutor(max_workers=app.config['SHARD_FANOUT_WORKERS'], thread_name_prefix='shard')
+
+def fan_out(func):
+    """Run func(conn) against every database in parallel and return the results"""
+    def run(path):
+        conn = connect_db(path)
+        try:
+            return func(conn)
+        finally:
+            conn.close()
+    return list(_fanout_pool.map(run, all_databases()))
+
+def aggregate_stats():
+    """Record counts and grade totals summed across every school"""
+    def school_stats(conn):
+        return dict(conn.execute('''SELECT
+            (SELECT COUNT(*) FROM students) AS students,
+            (SELECT COUNT(*) FROM subjects) AS subjects,
+            (SELECT COUNT(*) FROM grades) AS grades,
+            (SELECT COALESCE(SUM(final_grade), 0) FROM grades) AS grade_sum,
+            (SELECT COUNT(*) FROM grades WHERE final_grade >= 75) AS passed''').fetchone())
+    rows = fan_out(school_stats)
+    return {key: sum(row[key] for row in rows) for key in rows[0]}
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -125,6 +296,524 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def compute_final_grade(education_level, prelim, midterm, finals):
+    """Return (final_grade, remarks) for a student's component grades"""
+    # Tertiary uses midterm & finals average, others use 3-term average
+    if education_level == 'Tertiary':
+        final_grade = (midterm + finals) / 2
+    else:
+        final_grade = (prelim + midterm + finals) / 3
+    remarks = 'PASSED' if final_grade >= 75 else 'FAILED'
+    return final_grade, remarks
+
+# Password hashing
+_hash_prefixes = {}
+
+def hash_password(password):
+    return generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
+
+def password_needs_rehash(pwhash):
+    """True if a stored hash was made with a different method or cost"""
+    method = app.config['PASSWORD_HASH_METHOD']
+    if method not in _hash_prefixes:
+        # Normalise shorthand like 'scrypt' to the full 'scrypt:32768:8:1'
+        _hash_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return pwhash.split('$', 1)[0] != _hash_prefixes[method]
+
+# Rate limiting
+class RateLimiter:
+    """Token-bucket rate limiter held in memory or in a shared SQLite file"""
+
+    # Seconds between sweeps for buckets that have refilled completely
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, path=None):
+        self.path = path
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.last_prune = time.time()
+        if path:
+            conn = sqlite3.connect(path)
+            conn.execute('''CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_buckets_full_at ON buckets (full_at)')
+            conn.commit()
+            conn.close()
+
+    def consume(self, key, capacity, rate):
+        """Take a token for key; return seconds to wait, or 0 if allowed"""
+        now = time.time()
+        if self.path:
+            return self._consume_file(key, capacity, rate, now)
+        with self.lock:
+            tokens, updated, _ = self.buckets.get(key, (capacity, now, now))
+            tokens, wait = self._take(tokens, updated, capacity, rate, now)
+            self.buckets[key] = (tokens, now, self._full_at(tokens, capacity, rate, now))
+            if now - self.last_prune >= self.PRUNE_INTERVAL:
+                self.last_prune = now
+                # Buckets that have refilled completely behave like missing ones
+                for k in [k for k, (_, _, full_at) in self.buckets.items() if full_at <= now]:
+                    del self.buckets[k]
+        return wait
+
+    @staticmethod
+    def _take(tokens, updated, capacity, rate, now):
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            return tokens - 1, 0
+        return tokens, (1 - tokens) / rate
+
+    @staticmethod
+    def _full_at(tokens, capacity, rate, now):
+        # Stored per bucket, since IP and username buckets refill at different rates
+        return now + (capacity - tokens) / rate
+
+    def _consume_file(self, key, capacity, rate, now):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens, wait = self._take(tokens, updated, capacity, rate, now)
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, self._full_at(tokens, capacity, rate, now)))
+            if now - self.last_prune >= self.PRUNE_INTERVAL:
+                self.last_prune = now
+                conn.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+            conn.commit()
+            return wait
+        finally:
+            conn.close()
+
+_login_limiter = None
+
+def get_login_limiter():
+    global _login_limiter
+    if _login_limiter is None:
+        _login_limiter = RateLimiter(app.config['LOGIN_RATE_LIMIT_FILE'])
+    return _login_limiter
+
+def login_rate_limit_wait(username):
+    """Seconds until another login attempt is allowed for this IP/username"""
+    limiter = get_login_limiter()
+    wait = limiter.consume(f'ip:{request.remote_addr}', *app.config['LOGIN_RATE_LIMIT_IP'])
+    if not wait and username:
+        wait = limiter.consume(f'user:{username.lower()}', *app.config['LOGIN_RATE_LIMIT_USERNAME'])
+    return wait
+
+# Background jobs
+#
+# Jobs are rows in the `jobs` table, so they survive restarts and can be
+# claimed by any gunicorn worker. A job's scope serialises work: only one job
+# per scope runs at a time, and a 'global' job excludes every other job.
+JOB_HANDLERS = {}
+
+class JobCancelled(Exception):
+    """Raised from JobContext.progress() once a cancel has been requested"""
+
+def job_handler(kind, admin_only=False, params=None):
+    """Register a function as the handler for a job kind
+
+    params maps each accepted parameter to a validator that returns the
+    cleaned value or raises ValueError; anything else is rejected.
+    """
+    def decorator(f):
+        JOB_HANDLERS[kind] = {'func': f, 'admin_only': admin_only, 'params': params or {}}
+        return f
+    return decorator
+
+def positive_int(value):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError('must be a positive integer')
+    return value
+
+def validate_job_params(handler, params):
+    """Return cleaned params for a handler, raising ValueError if invalid"""
+    unknown = set(params) - set(handler['params'])
+    if unknown:
+        raise ValueError(f"Unknown job param(s): {', '.join(sorted(unknown))}")
+    cleaned = {}
+    for name, value in params.items():
+        try:
+            cleaned[name] = handler['params'][name](value)
+        except ValueError as e:
+            raise ValueError(f'Invalid job param {name}: {e}')
+    return cleaned
+
+class JobContext:
+    """Handle passed to a job handler for reporting progress"""
+
+    def __init__(self, job):
+        self.id = job['id']
+        self.scope = job['scope']
+        self.user_id = job['created_by']
+        conn = get_main_db()
+        user = conn.execute('SELECT school FROM users WHERE id = ?', (self.user_id,)).fetchone()
+        conn.close()
+        self.school = user['school'] if user else None
+
+    def databases(self):
+        """Connections to the databases this job covers ('global' jobs cover every school)"""
+        if self.scope == 'global':
+            return [connect_db(path) for path in all_databases()]
+        return [get_db(self.school)]
+
+    def progress(self, done, total=None, message=None):
+        """Record progress and raise JobCancelled if the job was cancelled"""
+        conn = get_main_db()
+        conn.execute('''UPDATE jobs SET progress = ?, total = COALESCE(?, total), message = COALESCE(?, message),
+                        heartbeat_at = CURRENT_TIMESTAMP WHERE id = ?''',
+                     (done, total, message, self.id))
+        conn.commit()
+        row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (self.id,)).fetchone()
+        conn.close()
+        if row and row['cancel_requested']:
+            raise JobCancelled()
+
+class JobRunner:
+    """In-process worker pool that claims queued jobs from the database"""
+
+    def __init__(self, max_workers, poll_interval, stale_after):
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.wakeup = threading.Event()
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._loop, name='job-runner', daemon=True).start()
+
+    def notify(self):
+        """Wake the runner so newly queued jobs start without waiting a poll"""
+        self.wakeup.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self._heartbeat()
+                self._requeue_stale()
+                self._dispatch()
+            except sqlite3.Error:
+                app.logger.exception('Job runner failed to poll the jobs table')
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def _heartbeat(self):
+        with self.lock:
+            active = list(self.active)
+        if not active:
+            return
+        conn = get_main_db()
+        conn.execute('UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id IN (%s)' % ','.join('?' * len(active)),
+                     active)
+        conn.commit()
+        conn.close()
+
+    def _requeue_stale(self):
+        # A running job with no recent heartbeat belonged to a process that died
+        conn = get_main_db()
+        conn.execute('''UPDATE jobs SET status = 'queued', started_at = NULL, heartbeat_at = NULL
+                        WHERE status = 'running' AND heartbeat_at < datetime('now', ?)''',
+                     ('-%d seconds' % self.stale_after,))
+        conn.commit()
+        conn.close()
+
+    def _dispatch(self):
+        while self.slots.acquire(blocking=False):
+            job = self._claim()
+            if job is None:
+                self.slots.release()
+                break
+            with self.lock:
+                self.active.add(job['id'])
+            self.executor.submit(self._run, job)
+
+    def _claim(self):
+        conn = get_main_db()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            job = conn.execute('''
+                SELECT * FROM jobs j
+                WHERE j.status = 'queued' AND NOT EXISTS (
+                    SELECT 1 FROM jobs r WHERE r.status = 'running'
+                    AND (r.scope = j.scope OR r.scope = 'global' OR j.scope = 'global'))
+                ORDER BY j.id
+                LIMIT 1
+            ''').fetchone()
+            if job:
+                conn.execute('''UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP,
+                                heartbeat_at = CURRENT_TIMESTAMP WHERE id = ?''', (job['id'],))
+            conn.commit()
+            return dict(job) if job else None
+        finally:
+            conn.close()
+
+    def _run(self, job):
+        status, result, error = 'succeeded', None, None
+        try:
+            handler = JOB_HANDLERS.get(job['kind'])
+            if handler is None:
+                raise LookupError(f"Unknown job kind: {job['kind']}")
+            result = handler['func'](JobContext(job), **json.loads(job['params']))
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            app.logger.exception('Job %s (%s) failed', job['id'], job['kind'])
+            status, error = 'failed', str(e)
+        try:
+            conn = get_main_db()
+            conn.execute('''UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+                            WHERE id = ?''',
+                         (status, json.dumps(result) if result is not None else None, error, job['id']))
+            conn.commit()
+            conn.close()
+        finally:
+            with self.lock:
+                self.active.discard(job['id'])
+            self.slots.release()
+            self.notify()
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """Run init_db() once per process, e.g. when started by gunicorn"""
+    path = app.config['DATABASE']
+    with _schema_lock:
+        if path not in _schema_ready:
+            init_db()
+            _schema_ready.add(path)
+
+def get_job_runner():
+    """Return this process's job runner, starting it on first use"""
+    global _job_runner
+    ensure_schema()
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner(app.config['JOB_WORKERS'], app.config['JOB_POLL_INTERVAL'],
+                                    app.config['JOB_STALE_AFTER'])
+            _job_runner.start()
+    return _job_runner
+
+def enqueue_job(kind, scope, params=None, user_id=None):
+    """Queue a job and return its id"""
+    conn = get_main_db()
+    cur = conn.execute('INSERT INTO jobs (kind, scope, params, created_by) VALUES (?, ?, ?, ?)',
+                       (kind, scope, json.dumps(params or {}), user_id))
+    conn.commit()
+    job_id = cur.lastrowid
+    conn.close()
+    get_job_runner().notify()
+    return job_id
+
+@app.before_request
+def start_job_runner():
+    # The jobs table must exist before the runner polls it, so migrate first;
+    # start lazily so jobs left over from a previous run resume once serving
+    ensure_schema()
+    if _job_runner is None:
+        get_job_runner()
+
+# Response compression
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'application/javascript',
+                          'text/javascript', 'application/json', 'image/svg+xml'}
+
+def choose_encoding():
+    """Pick the best Content-Encoding the client accepts, or None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL'], mtime=0)
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) >= app.config['COMPRESS_MIN_SIZE']:
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding()
+        if encoding:
+            response.set_data(compress(data, encoding))
+            response.headers['Content-Encoding'] = encoding
+    record_response_size(len(data), response.content_length)
+    return response
+
+# Fingerprinted static assets
+#
+# url_for('static', filename='styles.css') produces /static/styles.<hash>.css,
+# which is served with a far-future Cache-Control since any change to the file
+# changes its URL. Compressed copies are built once per file version.
+class StaticAssets:
+    FINGERPRINT_RE = re.compile(r'^(.*)\.([0-9a-f]{10})(\.[^./]+)$')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.versions = {}
+        self.compressed = {}
+        # Bumped whenever a known file's content hash changes
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def path(self, filename):
+        """Absolute path of a static file, or None if it escapes the folder"""
+        return safe_join(self.folder, filename)
+
+    def version(self, filename):
+        """Short content hash of a static file, or None if it doesn't exist"""
+        path = self.path(filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        mtime = os.stat(path).st_mtime
+        cached = self.versions.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:10]
+        if cached and cached[1] != digest:
+            self.generation += 1
+        self.versions[filename] = (mtime, digest)
+        return digest
+
+    def refresh(self):
+        """Re-check every known file and return the current generation"""
+        for filename in list(self.versions):
+            self.version(filename)
+        return self.generation
+
+    def fingerprint(self, filename):
+        digest = self.version(filename)
+        if digest is None:
+            return filename
+        base, ext = os.path.splitext(filename)
+        return f'{base}.{digest}{ext}'
+
+    def resolve(self, filename):
+        """Map a requested name to (real filename, whether it was fingerprinted)"""
+        match = self.FINGERPRINT_RE.match(filename)
+        if match:
+            real = match.group(1) + match.group(3)
+            if self.version(real) == match.group(2):
+                return real, True
+        return filename, False
+
+    def compressed_body(self, filename, encoding):
+        key = (filename, self.version(filename), encoding)
+        with self.lock:
+            body = self.compressed.get(key)
+        if body is None:
+            with open(self.path(filename), 'rb') as f:
+                body = compress(f.read(), encoding)
+            with self.lock:
+                self.compressed[key] = body
+        return body
+
+static_assets = StaticAssets(app.static_folder)
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = static_assets.fingerprint(values['filename'])
+
+def serve_static(filename):
+    """Static file view with fingerprint caching and precompressed bodies"""
+    if static_assets.path(filename) is None:
+        abort(404)
+    real, fingerprinted = static_assets.resolve(filename)
+    mimetype = mimetypes.guess_type(real)[0]
+    encoding = choose_encoding() if mimetype in COMPRESSIBLE_MIMETYPES else None
+    if encoding and static_assets.version(real):
+        response = app.response_class(static_assets.compressed_body(real, encoding), mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f'{static_assets.version(real)}-{encoding}')
+        response.make_conditional(request)
+    else:
+        response = send_from_directory(app.static_folder, real)
+    if mimetype in COMPRESSIBLE_MIMETYPES:
+        response.vary.add('Accept-Encoding')
+    if fingerprinted:
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = serve_static
+
+# Cached page fragments
+#
+# base.html renders its chrome through fragment(), which caches the rendered
+# HTML per template and key. Everything a fragment depends on must be passed
+# as a key; static asset versions are part of every key, so fingerprinted
+# URLs inside a fragment follow edits to the files. Caching is skipped in
+# debug mode so template edits show up.
+_fragments = {}
+
+@app.template_global()
+def fragment(name, **key):
+    if 'static_generation' not in g:
+        g.static_generation = static_assets.refresh()
+    cache_key = (name, request.script_root, g.static_generation, tuple(sorted(key.items())))
+    html = None if app.debug else _fragments.get(cache_key)
+    if html is None:
+        html = Markup(render_template(name, **key))
+        if len(_fragments) > 1000:
+            _fragments.clear()
+        _fragments[cache_key] = html
+    return html
+
+# Render timing
+#
+# Per-template render times and per-endpoint response sizes (before and after
+# compression), exposed to admins at /api/render-stats and to browsers via the
+# Server-Timing header.
+_render_stats = {'templates': {}, 'response_bytes': {}, 'sent_bytes': {}}
+_render_stats_lock = threading.Lock()
+
+def _update_stat(table, key, value):
+    with _render_stats_lock:
+        stat = _render_stats[table].setdefault(key, {'count': 0, 'total': 0, 'max': 0})
+        stat['count'] += 1
+        stat['total'] += value
+        stat['max'] = max(stat['max'], value)
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_starts', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    starts = g.get('render_starts')
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+    _update_stat('templates', template.name, elapsed_ms)
+    if not starts:
+        # Outermost template: report the page's total render time
+        g.render_ms = g.get('render_ms', 0) + elapsed_ms
+
+def record_response_size(size, sent):
+    if request.endpoint and request.endpoint != 'static':
+        _update_stat('response_bytes', request.endpoint, size)
+        _update_stat('sent_bytes', request.endpoint, sent)
+
+@app.after_request
+def add_server_timing(response):
+    if 'render_ms' in g:
+        response.headers['Server-Timing'] = f'render;dur={g.render_ms:.2f}'
+    return response
+
 # Routes
 @app.route('/')
 def index():
@@ -150,10 +839,10 @@ def signup():
             flash('Passwords do not match!', 'danger')
             return redirect(url_for('signup'))
         
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         
         try:
-            conn = get_db()
+            conn = get_main_db()
             conn.execute('INSERT INTO users (username, email, password, role, education_level) VALUES (?, ?, ?, ?, ?)',
                         (username, email, hashed_password, 'teacher', education_level))
             conn.commit()
@@ -169,15 +858,29 @@ def signup():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """User login"""
+    # An already authenticated session skips the (expensive) password check
+    if 'user_id' in session and (request.method == 'GET' or request.form.get('username') == session.get('username')):
+        return redirect(url_for('dashboard'))
+
     if request.method == 'POST':
         username = request.form.get('username')
-        password = request.form.get('password')
+        password = request.form.get('password') or ''
         
-        conn = get_db()
-        user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
+        # Refuse before touching the (expensive) password hash
+        wait = login_rate_limit_wait(username)
+        if wait:
+            flash('Too many login attempts. Please try again later.', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(math.ceil(wait))}
+        
+        conn = get_main_db()
+        user = conn.execute('SELECT id, username, password, role, education_level, school FROM users WHERE username = ?',
+                            (username,)).fetchone()
         
         if user and check_password_hash(user['password'], password):
+            if password_needs_rehash(user['password']):
+                conn.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password), user['id']))
+                conn.commit()
+            conn.close()
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
@@ -185,6 +888,7 @@ def login():
             flash(f'Welcome back, {username}!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            conn.close()
             flash('Invalid username or password!', 'danger')
     
     return render_template('login.html')
@@ -209,7 +913,11 @@ def dashboard():
 
     # Get statistics
     teacher_id = session.get('user_id')
-    if is_admin or not edu_level:
+    if admin_viewing_all_schools():
+        # Fan out across every school's database
+        totals = aggregate_stats()
+        total_students, total_subjects, total_grades = totals['students'], totals['subjects'], totals['grades']
+    elif is_admin or not edu_level:
         total_students = conn.execute('SELECT COUNT(*) as count FROM students').fetchone()['count']
         total_subjects = conn.execute('SELECT COUNT(*) as count FROM subjects').fetchone()['count']
         total_grades = conn.execute('SELECT COUNT(*) as count FROM grades').fetchone()['count']
@@ -268,7 +976,7 @@ def profile():
     if not user_id:
         flash('Session expired. Please log in again.', 'warning')
         return redirect(url_for('login'))
-    conn = get_db()
+    conn = get_main_db()
     user = conn.execute('SELECT id, username, email, role, education_level, created_at FROM users WHERE id = ?', (user_id,)).fetchone()
     conn.close()
     if not user:
@@ -285,7 +993,7 @@ def edit_profile():
     if not user_id:
         flash('Session expired. Please log in again.', 'warning')
         return redirect(url_for('login'))
-    conn = get_db()
+    conn = get_main_db()
     if request.method == 'POST':
         username = request.form.get('username')
         email = request.form.get('email')
@@ -294,7 +1002,7 @@ def edit_profile():
 
         try:
             if password:
-                hashed = generate_password_hash(password)
+                hashed = hash_password(password)
                 conn.execute('''UPDATE users SET username = ?, email = ?, education_level = ?, password = ? WHERE id = ?''',
                              (username, email, education_level, hashed, user_id))
             else:
@@ -597,11 +1305,7 @@ def add_grade():
         student_edu = student_row['education_level'] if student_row else 'Secondary'
 
         # Calculate final grade: tertiary uses midterm & finals average, others use 3-term average
-        if student_edu == 'Tertiary':
-            final_grade = (midterm + finals) / 2
-        else:
-            final_grade = (prelim + midterm + finals) / 3
-        remarks = 'PASSED' if final_grade >= 75 else 'FAILED'
+        final_grade, remarks = compute_final_grade(student_edu, prelim, midterm, finals)
         
         conn.execute('''INSERT INTO grades (student_id, subject_id, quarter, prelim, midterm, finals, final_grade, remarks, teacher_id)
                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
@@ -642,11 +1346,7 @@ def edit_grade(grade_id):
         row = conn.execute('SELECT g.student_id, s.education_level FROM grades g JOIN students s ON g.student_id = s.id WHERE g.id = ?', (grade_id,)).fetchone()
         student_edu = row['education_level'] if row else 'Secondary'
 
-        if student_edu == 'Tertiary':
-            final_grade = (midterm + finals) / 2
-        else:
-            final_grade = (prelim + midterm + finals) / 3
-        remarks = 'PASSED' if final_grade >= 75 else 'FAILED'
+        final_grade, remarks = compute_final_grade(student_edu, prelim, midterm, finals)
         
         conn.execute('''UPDATE grades 
                        SET prelim = ?, midterm = ?, finals = ?, final_grade = ?, remarks = ?, updated_at = CURRENT_TIMESTAMP
@@ -713,7 +1413,15 @@ def api_stats():
     is_admin = session.get('role') == 'admin'
 
     teacher_id = session.get('user_id')
-    if is_admin or not edu_level:
+    if is_admin and (request.args.get('scope') == 'all' or admin_viewing_all_schools()):
+        # Admin stats for every school fan out across all databases
+        totals = aggregate_stats()
+        total_students = totals['students']
+        total_subjects = totals['subjects']
+        total_grades = totals['grades']
+        avg_grade = totals['grade_sum'] / total_grades if total_grades else 0
+        passed = totals['passed']
+    elif is_admin or not edu_level:
         total_students = conn.execute('SELECT COUNT(*) as count FROM students').fetchone()['count']
         total_subjects = conn.execute('SELECT COUNT(*) as count FROM subjects').fetchone()['count']
         total_grades = conn.execute('SELECT COUNT(*) as count FROM grades').fetchone()['count']
@@ -740,6 +1448,261 @@ def api_stats():
     conn.close()
     return jsonify(stats)
 
+@app.route('/admin/school', methods=['POST'])
+@login_required
+def select_school():
+    """Choose which school's database an admin is browsing"""
+    if session.get('role') != 'admin':
+        flash('Only admins can switch schools.', 'danger')
+        return redirect(url_for('dashboard'))
+    school = request.form.get('school', '')
+    if school == '*':
+        session.pop('admin_school', None)
+        flash('Now viewing totals for all schools.', 'info')
+    elif school and school not in available_schools():
+        flash('Unknown school.', 'danger')
+    else:
+        session['admin_school'] = school
+        flash(f"Now viewing {school or 'the main database'}.", 'info')
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/render-stats')
+@login_required
+def api_render_stats():
+    """Template render times (ms) and response sizes (bytes) per endpoint"""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Only admins can view render stats.'}), 403
+    with _render_stats_lock:
+        stats = {table: {key: dict(stat, avg=round(stat['total'] / stat['count'], 2))
+                         for key, stat in rows.items()}
+                 for table, rows in _render_stats.items()}
+    return jsonify(stats)
+
+# Job handlers
+@job_handler('recompute_grades', params={'batch_size': positive_int})
+def recompute_grades_job(job, batch_size=200):
+    """Recalculate final grades and remarks in batches"""
+    sql = '''SELECT g.id, g.prelim, g.midterm, g.finals, s.education_level
+             FROM grades g JOIN students s ON g.student_id = s.id'''
+    params = ()
+    if job.scope != 'global':
+        sql += ' WHERE s.teacher_id = ?'
+        params = (job.user_id,)
+    conns = job.databases()
+    updated = 0
+    try:
+        work = [(conn, conn.execute(sql + ' ORDER BY g.id', params).fetchall()) for conn in conns]
+        total = sum(len(rows) for _, rows in work)
+        for conn, rows in work:
+            for start in range(0, len(rows), batch_size):
+                batch = []
+                for row in rows[start:start + batch_size]:
+                    final_grade, remarks = compute_final_grade(row['education_level'], row['prelim'] or 0,
+                                                               row['midterm'] or 0, row['finals'] or 0)
+                    batch.append((final_grade, remarks, row['id']))
+                conn.executemany('UPDATE grades SET final_grade = ?, remarks = ? WHERE id = ?', batch)
+                conn.commit()
+                updated += len(batch)
+                job.progress(updated, total, f'Recomputed {updated} of {total} grades')
+    finally:
+        for conn in conns:
+            conn.close()
+    return {'updated': updated}
+
+@job_handler('migrate_schema', admin_only=True)
+def migrate_schema_job(job):
+    """Run the schema migrations in init_db()"""
+    job.progress(0, 1, 'Migrating schema')
+    init_db()
+    job.progress(1, 1, 'Schema up to date')
+
+def job_to_dict(job):
+    job = dict(job)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['percent'] = round(job['progress'] * 100 / job['total'], 1) if job['total'] else 0
+    return job
+
+def get_visible_job(conn, job_id):
+    """Fetch a job the current user may see (admins see all jobs)"""
+    if session.get('role') == 'admin':
+        return conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return conn.execute('SELECT * FROM jobs WHERE id = ? AND created_by = ?',
+                        (job_id, session.get('user_id'))).fetchone()
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@login_required
+def api_jobs():
+    """List jobs or queue a new one"""
+    is_admin = session.get('role') == 'admin'
+    user_id = session.get('user_id')
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind')
+        params = data.get('params') or {}
+        handler = JOB_HANDLERS.get(kind)
+        if handler is None:
+            return jsonify({'error': f'Unknown job kind: {kind}'}), 400
+        if handler['admin_only'] and not is_admin:
+            return jsonify({'error': 'Only admins can run this job.'}), 403
+        if not isinstance(params, dict):
+            return jsonify({'error': 'Job params must be an object.'}), 400
+        try:
+            params = validate_job_params(handler, params)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Admin jobs cover every teacher's data, so they run exclusively
+        scope = 'global' if is_admin else f'user:{user_id}'
+        job_id = enqueue_job(kind, scope, params, user_id)
+        conn = get_main_db()
+        job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        return jsonify(job_to_dict(job)), 202
+
+    conn = get_main_db()
+    if is_admin:
+        jobs = conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT 50').fetchall()
+    else:
+        jobs = conn.execute('SELECT * FROM jobs WHERE created_by = ? ORDER BY id DESC LIMIT 50', (user_id,)).fetchall()
+    conn.close()
+    return jsonify([job_to_dict(j) for j in jobs])
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    """Get job status and progress"""
+    conn = get_main_db()
+    job = get_visible_job(conn, job_id)
+    conn.close()
+    if not job:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job_to_dict(job))
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def api_cancel_job(job_id):
+    """Cancel a queued job or ask a running job to stop"""
+    conn = get_main_db()
+    job = get_visible_job(conn, job_id)
+    if not job:
+        conn.close()
+        return jsonify({'error': 'Job not found.'}), 404
+    # Queued jobs are cancelled outright; running jobs stop at their next progress update
+    conn.execute('''UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'queued' ''', (job_id,))
+    conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+    conn.commit()
+    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    return jsonify(job_to_dict(job))
+
+# CLI commands
+@app.cli.command('bench-login')
+@click.option('--method', default=None, help='Hash method to benchmark (default: PASSWORD_HASH_METHOD).')
+@click.option('--seconds', default=3.0, help='How long to run the benchmark.')
+def bench_login(method, seconds):
+    """Report password-check logins/sec on a single core"""
+    method = method or app.config['PASSWORD_HASH_METHOD']
+    pwhash = generate_password_hash('benchmark-password', method=method)
+    checks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        check_password_hash(pwhash, 'benchmark-password')
+        checks += 1
+    elapsed = time.perf_counter() - start
+    click.echo(f'{method}: {checks / elapsed:.1f} logins/sec per core '
+               f'({elapsed / checks * 1000:.1f} ms per check)')
+
+def copy_row(conn, table, row, reusable, **overrides):
+    """Insert row without its id and return the new id
+
+    A row that was already in the school database before this run and is
+    identical is reused instead, so rerunning an interrupted migration
+    doesn't duplicate data. reusable holds the ids of those rows that no
+    other copied row has claimed yet. Any other conflict raises
+    IntegrityError.
+    """
+    values = {key: row[key] for key in row.keys() if key != 'id'}
+    values.update(overrides)
+    cols = list(values)
+    matches = conn.execute(f"SELECT id FROM {table} WHERE {' AND '.join(f'{c} IS ?' for c in cols)} ORDER BY id",
+                           tuple(values.values())).fetchall()
+    for match in matches:
+        if match['id'] in reusable:
+            reusable.discard(match['id'])
+            return match['id']
+    cur = conn.execute(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                       tuple(values.values()))
+    return cur.lastrowid
+
+@app.cli.command('migrate-school')
+@click.argument('school')
+@click.argument('usernames', nargs=-1, required=True)
+def migrate_school(school, usernames):
+    """Move USERNAMES and their students, subjects and grades into SCHOOL's database"""
+    if not SCHOOL_KEY_RE.match(school):
+        raise click.BadParameter('use lowercase letters, digits, "-" and "_"', param_hint='SCHOOL')
+    init_db()
+    main = get_main_db()
+    try:
+        users = main.execute('SELECT id, username, school FROM users WHERE username IN (%s)'
+                             % ','.join('?' * len(usernames)), usernames).fetchall()
+        missing = set(usernames) - {u['username'] for u in users}
+        if missing:
+            raise click.ClickException(f"Unknown user(s): {', '.join(sorted(missing))}")
+        if any(u['school'] for u in users):
+            raise click.ClickException('Users already assigned to a school cannot be migrated again.')
+
+        teacher_ids = [u['id'] for u in users]
+        marks = ','.join('?' * len(teacher_ids))
+        students = main.execute(f'SELECT * FROM students WHERE teacher_id IN ({marks})', teacher_ids).fetchall()
+        student_ids = [s['id'] for s in students]
+        grades = main.execute('SELECT * FROM grades WHERE student_id IN (%s)' % ','.join('?' * len(student_ids)),
+                              student_ids).fetchall()
+        # Copy subjects owned by these teachers plus any other subject their grades use
+        subject_ids = {g['subject_id'] for g in grades}
+        subjects = main.execute(f'SELECT * FROM subjects WHERE teacher_id IN ({marks}) OR id IN (%s)'
+                                % ','.join('?' * len(subject_ids)), teacher_ids + list(subject_ids)).fetchall()
+        # Grades of deleted subjects can't be linked up in the school database;
+        # leave them in the main database and report them
+        known_subjects = {s['id'] for s in subjects}
+        orphans = [g for g in grades if g['subject_id'] not in known_subjects]
+        grades = [g for g in grades if g['subject_id'] in known_subjects]
+
+        # Copy into the school database first. Rows get new ids there, since the
+        # school may already hold data, and grades are pointed at the new ids.
+        shard = get_db(school)
+        try:
+            reusable = {table: {row['id'] for row in shard.execute(f'SELECT id FROM {table}')}
+                        for table in ('students', 'subjects', 'grades')}
+            student_map = {row['id']: copy_row(shard, 'students', row, reusable['students']) for row in students}
+            subject_map = {row['id']: copy_row(shard, 'subjects', row, reusable['subjects']) for row in subjects}
+            for row in grades:
+                copy_row(shard, 'grades', row, reusable['grades'], student_id=student_map[row['student_id']],
+                         subject_id=subject_map[row['subject_id']])
+            shard.commit()
+        except sqlite3.IntegrityError as e:
+            shard.rollback()
+            raise click.ClickException(f'{school} already has a conflicting record ({e}); nothing was moved.')
+        finally:
+            shard.close()
+
+        main.execute(f'UPDATE users SET school = ? WHERE id IN ({marks})', [school] + teacher_ids)
+        main.execute('DELETE FROM grades WHERE id IN (%s)' % ','.join('?' * len(grades)), [g['id'] for g in grades])
+        main.execute(f'DELETE FROM students WHERE teacher_id IN ({marks})', teacher_ids)
+        # Keep subjects that grades left behind in the main database still use
+        main.execute(f'DELETE FROM subjects WHERE teacher_id IN ({marks}) AND id NOT IN (SELECT subject_id FROM grades)',
+                     teacher_ids)
+        main.commit()
+    finally:
+        main.close()
+    click.echo(f'Moved {len(users)} user(s), {len(students)} students, {len(subjects)} subjects '
+               f'and {len(grades)} grades to {shard_path(school)}')
+    if orphans:
+        click.echo(f"Left {len(orphans)} grade(s) whose subject no longer exists in the main database "
+                   f"(grade ids: {', '.join(str(g['id']) for g in orphans)})", err=True)
+
 if __name__ == '__main__':
     # Always initialize/migrate database
     init_db()
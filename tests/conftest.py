@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as grading_app  # noqa: E402
+
+# Background threads may outlive a test; keep them away from the real database
+_session_dir = tempfile.mkdtemp()
+grading_app.app.config['DATABASE'] = os.path.join(_session_dir, 'grading_system.db')
+grading_app.app.config['SHARD_DIR'] = os.path.join(_session_dir, 'shards')
+grading_app.init_db()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The Flask app pointed at a throwaway database"""
+    monkeypatch.setitem(grading_app.app.config, 'DATABASE', str(tmp_path / 'grading_system.db'))
+    monkeypatch.setitem(grading_app.app.config, 'SHARD_DIR', str(tmp_path / 'shards'))
+    monkeypatch.setitem(grading_app.app.config, 'JOB_POLL_INTERVAL', 0.1)
+    monkeypatch.setattr(grading_app, '_login_limiter', None)
+    grading_app.app.config['TESTING'] = True
+    return grading_app.app
+
+
+@pytest.fixture
+def db(app):
+    grading_app.init_db()
+    return grading_app
+
+
+@pytest.fixture
+def make_user(db):
+    def make_user(username, role='teacher', education_level='Secondary', password='pw'):
+        conn = db.get_main_db()
+        cur = conn.execute('INSERT INTO users (username, email, password, role, education_level) VALUES (?, ?, ?, ?, ?)',
+                           (username, f'{username}@example.com', generate_password_hash(password), role,
+                            education_level))
+        conn.commit()
+        conn.close()
+        return cur.lastrowid
+    return make_user
+
+
+def login(client, username, password='pw'):
+    return client.post('/login', data={'username': username, 'password': password})
@@ -0,0 +1,86 @@
+import sqlite3
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from conftest import login
+
+
+def wait_for_job(client, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def test_jobs_table_created_on_first_request_for_existing_database(app):
+    # A database from before the jobs table existed, as served by gunicorn
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute('''CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL, password TEXT NOT NULL, role TEXT NOT NULL DEFAULT 'teacher',
+                    education_level TEXT DEFAULT 'Secondary', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("INSERT INTO users (username, email, password, role) VALUES ('admin', 'a@example.com', ?, 'admin')",
+                 (generate_password_hash('pw'),))
+    conn.commit()
+    conn.close()
+
+    client = app.test_client()
+    login(client, 'admin')
+    response = client.post('/api/jobs', json={'kind': 'migrate_schema'})
+    assert response.status_code == 202
+    assert wait_for_job(client, response.get_json()['id'])['status'] == 'succeeded'
+
+
+def test_recompute_grades_job(db, make_user, app):
+    teacher_id = make_user('teacher')
+    conn = db.get_main_db()
+    conn.execute('''INSERT INTO students (student_id, first_name, last_name, email, section, year_level, teacher_id)
+                    VALUES ('S1', 'Ana', 'Cruz', 'ana@example.com', 'A', '1', ?)''', (teacher_id,))
+    conn.execute("INSERT INTO subjects (subject_code, subject_name, teacher_id) VALUES ('MATH', 'Math', ?)", (teacher_id,))
+    conn.execute('''INSERT INTO grades (student_id, subject_id, quarter, prelim, midterm, finals, final_grade, teacher_id)
+                    VALUES (1, 1, '1st', 80, 80, 80, 0, ?)''', (teacher_id,))
+    conn.commit()
+    conn.close()
+
+    client = app.test_client()
+    login(client, 'teacher')
+    response = client.post('/api/jobs', json={'kind': 'recompute_grades'})
+    job = wait_for_job(client, response.get_json()['id'])
+    assert job['status'] == 'succeeded'
+    assert job['result'] == {'updated': 1}
+
+    conn = db.get_main_db()
+    grade = conn.execute('SELECT final_grade, remarks FROM grades').fetchone()
+    conn.close()
+    assert tuple(grade) == (80.0, 'PASSED')
+
+
+@pytest.mark.parametrize('params, error', [
+    ({'batch_size': 0}, 'batch_size'),
+    ({'batch_size': -5}, 'batch_size'),
+    ({'batch_size': '10'}, 'batch_size'),
+    ({'batch_size': True}, 'batch_size'),
+    ({'unexpected': 1}, 'unexpected'),
+])
+def test_invalid_job_params_rejected_when_queued(make_user, app, params, error):
+    make_user('teacher')
+    client = app.test_client()
+    login(client, 'teacher')
+    response = client.post('/api/jobs', json={'kind': 'recompute_grades', 'params': params})
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+    assert client.get('/api/jobs').get_json() == []
+
+
+def test_valid_job_params_accepted(make_user, app):
+    make_user('teacher')
+    client = app.test_client()
+    login(client, 'teacher')
+    response = client.post('/api/jobs', json={'kind': 'recompute_grades', 'params': {'batch_size': 50}})
+    assert response.status_code == 202
+    assert response.get_json()['params'] == {'batch_size': 50}
+    assert wait_for_job(client, response.get_json()['id'])['status'] == 'succeeded'
@@ -0,0 +1,76 @@
+import sqlite3
+
+from werkzeug.security import generate_password_hash
+
+import app as grading_app
+from conftest import login
+
+
+def test_login_rehashes_password_made_with_old_cost(db, app):
+    conn = db.get_main_db()
+    conn.execute("INSERT INTO users (username, email, password) VALUES ('teacher', 't@example.com', ?)",
+                 (generate_password_hash('pw', method='pbkdf2:sha256:1000'),))
+    conn.commit()
+    conn.close()
+
+    response = login(app.test_client(), 'teacher')
+    assert response.status_code == 302
+
+    conn = db.get_main_db()
+    pwhash = conn.execute('SELECT password FROM users').fetchone()['password']
+    conn.close()
+    assert not db.password_needs_rehash(pwhash)
+
+
+def test_logged_in_session_skips_password_check(make_user, app, monkeypatch):
+    make_user('teacher')
+    client = app.test_client()
+    login(client, 'teacher')
+
+    def fail(*args):
+        raise AssertionError('password hash checked for an authenticated session')
+    monkeypatch.setattr(grading_app, 'check_password_hash', fail)
+    response = client.post('/login', data={'username': 'teacher', 'password': 'pw'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/dashboard')
+
+
+def test_username_limit_returns_429(make_user, app):
+    make_user('teacher')
+    client = app.test_client()
+    capacity = app.config['LOGIN_RATE_LIMIT_USERNAME'][0]
+    for _ in range(capacity):
+        assert login(client, 'teacher', 'wrong').status_code == 200
+    response = login(client, 'teacher', 'pw')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_prune_keeps_partly_drained_buckets_of_slower_rate(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(grading_app.time, 'time', lambda: clock[0])
+    limiter = grading_app.RateLimiter()
+    for _ in range(5):
+        limiter.consume('user:teacher', 5, 1 / 30)
+    # An IP bucket refills within a minute; the username bucket takes 150s
+    clock[0] += 90
+    limiter.consume('ip:10.0.0.1', 30, 0.5)
+    assert 'user:teacher' in limiter.buckets
+    clock[0] += 90
+    limiter.consume('ip:10.0.0.1', 30, 0.5)
+    assert 'user:teacher' not in limiter.buckets
+
+
+def test_file_store_prunes_refilled_buckets(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(grading_app.time, 'time', lambda: clock[0])
+    limiter = grading_app.RateLimiter(str(tmp_path / 'limits.db'))
+    limiter.consume('user:a', 5, 1 / 30)
+    limiter.consume('user:b', 5, 1 / 30)
+    clock[0] += 120
+    limiter.consume('user:c', 5, 1 / 30)
+
+    conn = sqlite3.connect(limiter.path)
+    keys = [row[0] for row in conn.execute('SELECT key FROM buckets')]
+    conn.close()
+    assert keys == ['user:c']
@@ -0,0 +1,197 @@
+import re
+
+import pytest
+
+import app as grading_app
+from conftest import login
+
+
+def add_student(conn, teacher_id, student_id):
+    cur = conn.execute('''INSERT INTO students (student_id, first_name, last_name, email, section, year_level, teacher_id)
+                          VALUES (?, 'First', 'Last', ?, 'A', '1', ?)''',
+                       (student_id, f'{student_id}@example.com', teacher_id))
+    return cur.lastrowid
+
+
+def add_subject(conn, teacher_id, code):
+    cur = conn.execute("INSERT INTO subjects (subject_code, subject_name, teacher_id) VALUES (?, ?, ?)",
+                       (code, code.title(), teacher_id))
+    return cur.lastrowid
+
+
+def add_grade(conn, teacher_id, student_id, subject_id, score):
+    conn.execute('''INSERT INTO grades (student_id, subject_id, quarter, prelim, midterm, finals, final_grade, remarks, teacher_id)
+                    VALUES (?, ?, '1st', ?, ?, ?, ?, 'PASSED', ?)''',
+                 (student_id, subject_id, score, score, score, score, teacher_id))
+
+
+def migrate(app, *args):
+    return app.test_cli_runner().invoke(args=['migrate-school', *args])
+
+
+@pytest.fixture
+def teachers(db, make_user):
+    """Two teachers with a student, subject and grade each in the main database"""
+    ids = {'a': make_user('a'), 'b': make_user('b')}
+    conn = db.get_main_db()
+    for username, score in (('a', 80), ('b', 90)):
+        teacher_id = ids[username]
+        student = add_student(conn, teacher_id, f'S-{username}')
+        subject = add_subject(conn, teacher_id, f'SUB-{username}')
+        add_grade(conn, teacher_id, student, subject, score)
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def school_rows(school, sql):
+    conn = grading_app.get_db(school)
+    rows = [tuple(row) for row in conn.execute(sql)]
+    conn.close()
+    return rows
+
+
+def test_migrate_into_empty_school(app, teachers):
+    result = migrate(app, 'north', 'a')
+    assert result.exit_code == 0, result.output
+
+    assert school_rows('north', 'SELECT student_id FROM students') == [('S-a',)]
+    assert school_rows('north', '''SELECT s.student_id, sub.subject_code, g.final_grade FROM grades g
+                                   JOIN students s ON g.student_id = s.id
+                                   JOIN subjects sub ON g.subject_id = sub.id''') == [('S-a', 'SUB-a', 80.0)]
+    assert school_rows(None, 'SELECT student_id FROM students') == [('S-b',)]
+    assert school_rows(None, "SELECT school FROM users WHERE username = 'a'") == [('north',)]
+
+
+def test_migrate_second_batch_into_non_empty_school(app, teachers):
+    assert migrate(app, 'north', 'a').exit_code == 0
+    # The school database has handed out ids of its own since the first batch
+    conn = grading_app.get_db('north')
+    extra = add_student(conn, teachers['a'], 'S-a2')
+    add_grade(conn, teachers['a'], extra, 1, 70)
+    conn.commit()
+    conn.close()
+
+    result = migrate(app, 'north', 'b')
+    assert result.exit_code == 0, result.output
+
+    assert school_rows('north', 'SELECT student_id, teacher_id FROM students ORDER BY student_id') == [
+        ('S-a', teachers['a']), ('S-a2', teachers['a']), ('S-b', teachers['b'])]
+    assert school_rows('north', '''SELECT s.student_id, sub.subject_code, g.final_grade FROM grades g
+                                   JOIN students s ON g.student_id = s.id
+                                   JOIN subjects sub ON g.subject_id = sub.id
+                                   ORDER BY s.student_id''') == [
+        ('S-a', 'SUB-a', 80.0), ('S-a2', 'SUB-a', 70.0), ('S-b', 'SUB-b', 90.0)]
+
+
+def test_rerun_after_interrupted_migration_does_not_duplicate(app, teachers, monkeypatch):
+    # Simulate a crash after the school database was written
+    conn = grading_app.get_db('north')
+    main = grading_app.get_main_db()
+    for row in main.execute("SELECT * FROM students WHERE student_id = 'S-a'"):
+        grading_app.copy_row(conn, 'students', row, set())
+    conn.commit()
+    conn.close()
+    main.close()
+
+    assert migrate(app, 'north', 'a').exit_code == 0
+    assert school_rows('north', 'SELECT student_id FROM students') == [('S-a',)]
+
+
+def test_conflicting_record_aborts_migration(app, teachers):
+    conn = grading_app.get_db('north')
+    add_student(conn, None, 'S-a')
+    conn.commit()
+    conn.close()
+
+    result = migrate(app, 'north', 'a')
+    assert result.exit_code != 0
+    assert 'conflicting record' in result.output
+    assert school_rows(None, 'SELECT student_id FROM students ORDER BY student_id') == [('S-a',), ('S-b',)]
+    assert school_rows('north', 'SELECT COUNT(*) FROM grades') == [(0,)]
+
+
+def test_session_from_before_migration_uses_school_database(app, teachers):
+    client = app.test_client()
+    login(client, 'a')
+    # Search is scoped by education level, so both teachers' students show up
+    assert [s['student_id'] for s in client.get('/api/students/search?q=S').get_json()] == ['S-a', 'S-b']
+
+    assert migrate(app, 'north', 'a').exit_code == 0
+
+    # Same session, no new login: reads and writes go to the school database
+    assert [s['student_id'] for s in client.get('/api/students/search?q=S').get_json()] == ['S-a']
+    client.post('/students/add', data={'student_id': 'S-new', 'first_name': 'New', 'last_name': 'Student',
+                                       'email': 'new@example.com', 'section': 'A', 'year_level': '1'})
+    assert school_rows('north', 'SELECT student_id FROM students ORDER BY student_id') == [('S-a',), ('S-new',)]
+    assert school_rows(None, 'SELECT student_id FROM students') == [('S-b',)]
+
+
+def test_admin_selects_school_and_aggregates(app, teachers, make_user):
+    assert migrate(app, 'north', 'a').exit_code == 0
+    make_user('admin', role='admin')
+    client = app.test_client()
+    login(client, 'admin')
+
+    # Until a school is picked, the dashboard totals cover every school
+    assert client.get('/api/stats').get_json()['total_students'] == 2
+    assert 'School: All schools' in client.get('/dashboard').get_data(as_text=True)
+
+    client.post('/admin/school', data={'school': ''})
+    assert client.get('/api/stats').get_json()['total_students'] == 1
+    assert client.get('/api/stats?scope=all').get_json()['total_students'] == 2
+
+    client.post('/admin/school', data={'school': '*'})
+    assert client.get('/api/stats').get_json()['total_students'] == 2
+
+    client.post('/admin/school', data={'school': 'north'})
+    assert [s['student_id'] for s in client.get('/api/students/search?q=S').get_json()] == ['S-a']
+    assert client.post('/admin/school', data={'school': 'missing'}).status_code == 302
+    assert [s['student_id'] for s in client.get('/api/students/search?q=S').get_json()] == ['S-a']
+
+    page = client.get('/dashboard').get_data(as_text=True)
+    assert 'School: north' in page
+    assert '<option value="north" selected>north</option>' in page
+
+
+def test_admin_dashboard_totals_cover_every_school(app, teachers, make_user):
+    assert migrate(app, 'north', 'a').exit_code == 0
+    assert migrate(app, 'south', 'b').exit_code == 0
+    make_user('admin', role='admin')
+    client = app.test_client()
+    login(client, 'admin')
+
+    stats = client.get('/api/stats').get_json()
+    assert (stats['total_students'], stats['total_grades'], stats['avg_grade']) == (2, 2, 85.0)
+    page = client.get('/dashboard').get_data(as_text=True)
+    assert re.search(r'>\s*2\s*<', page)
+
+
+def test_identical_grades_are_both_migrated(app, teachers):
+    # e.g. a double-submitted form within the same second
+    conn = grading_app.get_main_db()
+    row = conn.execute('SELECT * FROM grades WHERE teacher_id = ?', (teachers['a'],)).fetchone()
+    cols = [c for c in row.keys() if c != 'id']
+    conn.execute(f"INSERT INTO grades ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                 tuple(row[c] for c in cols))
+    conn.commit()
+    conn.close()
+
+    result = migrate(app, 'north', 'a')
+    assert result.exit_code == 0, result.output
+    assert school_rows('north', 'SELECT COUNT(*) FROM grades') == [(2,)]
+    assert school_rows(None, 'SELECT COUNT(*) FROM grades') == [(1,)]
+
+
+def test_grades_of_deleted_subjects_are_left_behind_and_reported(app, teachers):
+    conn = grading_app.get_main_db()
+    student = conn.execute("SELECT id FROM students WHERE student_id = 'S-a'").fetchone()['id']
+    add_grade(conn, teachers['a'], student, 999, 60)
+    conn.commit()
+    conn.close()
+
+    result = migrate(app, 'north', 'a')
+    assert result.exit_code == 0, result.output
+    assert 'Left 1 grade(s) whose subject no longer exists' in result.output
+    assert school_rows('north', 'SELECT final_grade FROM grades') == [(80.0,)]
+    assert school_rows(None, 'SELECT subject_id FROM grades WHERE teacher_id = %d' % teachers['a']) == [(999,)]
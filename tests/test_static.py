@@ -0,0 +1,52 @@
+import gzip
+import re
+import shutil
+
+import pytest
+
+import app as grading_app
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture
+def static_dir(app, tmp_path, monkeypatch):
+    """A writable copy of the static folder"""
+    folder = tmp_path / 'static'
+    shutil.copytree(app.static_folder, folder)
+    monkeypatch.setattr(app, 'static_folder', str(folder))
+    monkeypatch.setattr(grading_app, 'static_assets', grading_app.StaticAssets(str(folder)))
+    monkeypatch.setattr(grading_app, '_fragments', {})
+    return folder
+
+
+def stylesheet_url(client):
+    html = gzip.decompress(client.get('/about', headers=GZIP).data).decode()
+    return re.search(r'href="(/static/styles\.[0-9a-f]{10}\.css)"', html).group(1)
+
+
+@pytest.mark.parametrize('path', ['/static/../requirements.txt', '/static/..%2Ftemplates%2Fbase.html',
+                                  '/static/images/../../app.py'])
+@pytest.mark.parametrize('headers', [GZIP, {}])
+def test_static_rejects_paths_outside_folder(db, app, path, headers):
+    response = app.test_client().get(path, headers=headers)
+    assert response.status_code == 404
+
+
+def test_fingerprinted_asset_is_compressed_and_immutable(db, app, static_dir):
+    client = app.test_client()
+    response = client.get(stylesheet_url(client), headers=GZIP)
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert gzip.decompress(response.data) == (static_dir / 'styles.css').read_bytes()
+
+
+def test_cached_head_follows_stylesheet_edits(db, app, static_dir):
+    client = app.test_client()
+    old_url = stylesheet_url(client)
+    with open(static_dir / 'styles.css', 'a') as f:
+        f.write('\n.changed { color: red; }\n')
+    new_url = stylesheet_url(client)
+    assert new_url != old_url
+    assert client.get(new_url, headers=GZIP).status_code == 200